@@ -0,0 +1,115 @@
+from collections.abc import Collection
+from typing import Any
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi_cache.coder import Coder
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from urllib.parse import urlencode
+import orjson
+import xxhash
+
+from utils import get_current_manifest_store, get_manifest_digest
+
+CACHE_CONTROL = "public, max-age=30"
+
+
+def sorted_query(request: Request) -> str:
+    return urlencode(sorted(request.query_params.multi_items()))
+
+
+async def request_manifest_digest(request: Request) -> str:
+    """
+    Manifest digest a request is answered from, read once per request so that
+    its cache key and its ETag agree
+    """
+    state = request.scope.setdefault("state", {})
+    if "manifest_digest" not in state:
+        store = get_current_manifest_store()
+        # only a rebuild after an archive change is too slow for the loop
+        state["manifest_digest"] = (
+            store.digest if store else await run_in_threadpool(get_manifest_digest)
+        )
+    return state["manifest_digest"]
+
+
+async def query_key_builder(
+    func, namespace: str = "", *, request: Request, **kwargs
+) -> str:
+    """
+    Key on the manifest digest, the path and the sorted query so that repeated
+    list params given in a different order share a cache entry, and no entry
+    outlives the snapshot it was built from
+    """
+    digest = await request_manifest_digest(request)
+    return f"{namespace}:{digest}:{request.url.path}?{sorted_query(request)}"
+
+
+class ORJSONCoder(Coder):
+    """
+    Caches the rendered JSON body and serves hits as is, skipping response
+    validation and serialization
+    """
+
+    @classmethod
+    def encode(cls, value: Any) -> bytes:
+        if isinstance(value, Response):
+            return bytes(value.body)
+        return orjson.dumps(value)
+
+    @classmethod
+    def decode(cls, value: bytes) -> Any:
+        return orjson.loads(value)
+
+    @classmethod
+    def decode_as_type(cls, value: bytes, *, type_: Any) -> Response:
+        return Response(content=value, media_type="application/json")
+
+
+class ETagMiddleware:
+    """
+    Tags responses of the given paths with an ETag derived from the manifest
+    digest and the query, and answers matching If-None-Match with 304
+    """
+
+    def __init__(self, app: ASGIApp, paths: Collection[str]) -> None:
+        self.app = app
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or scope["path"] not in self.paths
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        digest = await request_manifest_digest(request)
+        etag = '"{}"'.format(
+            xxhash.xxh64(
+                f"{digest}|{request.url.path}?{sorted_query(request)}".encode()
+            ).hexdigest()
+        )
+
+        if_none_match = Headers(scope=scope).get("if-none-match", "")
+        if if_none_match == "*" or etag in (
+            tag.strip() for tag in if_none_match.split(",")
+        ):
+            response = Response(
+                status_code=304,
+                headers={"ETag": etag, "Cache-Control": CACHE_CONTROL},
+            )
+            await response(scope, receive, send)
+            return
+
+        async def send_with_etag(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                headers = MutableHeaders(scope=message)
+                headers["ETag"] = etag
+                headers["Cache-Control"] = CACHE_CONTROL
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
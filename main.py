@@ -1,42 +1,76 @@
 from typing import Annotated
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from more_itertools import ilen
-from itertools import islice
-from natsort import natsorted
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.decorator import cache
+from redis import asyncio as aioredis
 
-from os_types import OS, OSParams
+from caching import ETagMiddleware, ORJSONCoder, query_key_builder
+from os_types import OS, OSFilter, OSPageQuery, OSParams, OSSearchFilter
 
-from utils import get_filtered_os_manifests, get_archive_path, get_filtered_os_params
+from utils import (
+    get_filtered_ids,
+    get_os_page,
+    get_archive_path,
+    get_filtered_os_params,
+    get_manifest_store,
+    get_redis_url,
+    is_behind_proxy,
+)
 
-app = FastAPI()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000",
-        "https://api.isoarchives.org",
-        "https://isoarchives.org",
-    ],
-    allow_methods=["*"],
-    allow_headers=["*"],
-    allow_credentials=True,
-)
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    redis_url = get_redis_url()
+    # the in-memory backend never evicts expired keys, so without redis the
+    # responses are not cached; the etags still spare the unchanged ones
+    backend = (
+        RedisBackend(aioredis.from_url(redis_url)) if redis_url else InMemoryBackend()
+    )
+    FastAPICache.init(
+        backend,
+        prefix="iso",
+        coder=ORJSONCoder,
+        key_builder=query_key_builder,
+        enable=bool(redis_url),
+    )
+    # walk the archive and build the indexes before serving, so the first
+    # requests don't pay for it
+    await run_in_threadpool(get_manifest_store)
+    yield
 
-app.mount("/download", StaticFiles(directory=get_archive_path()), name="download")
 
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+app.add_middleware(ETagMiddleware, paths=["/os/params/", "/os/"])
+
+if not is_behind_proxy():
+    # behind nginx cors and the archive are handled there, see nginx.conf.example
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[
+            "http://localhost:3000",
+            "https://api.isoarchives.org",
+            "https://isoarchives.org",
+        ],
+        allow_methods=["*"],
+        allow_headers=["*"],
+        allow_credentials=True,
+    )
+    app.mount("/download", StaticFiles(directory=get_archive_path()), name="download")
 
-@app.get("/os/params/")
-def get_os_params(
-    variants: Annotated[list[str] | None, Query()] = None,
-    names: Annotated[list[str] | None, Query()] = None,
-    versions: Annotated[list[str] | None, Query()] = None,
-    disketteSizes: Annotated[list[str] | None, Query()] = None,
-    floppySizes: Annotated[list[str] | None, Query()] = None,
-    archs: Annotated[list[str] | None, Query()] = None,
-    tags: Annotated[list[str] | None, Query()] = None,
-) -> OSParams:
+
+# fastapi-cache rebuilds the signature without the return annotation, so the
+# response models are given to the routes
+@app.get("/os/params/", response_model=OSParams)
+@cache(expire=30)
+async def get_os_params(filters: Annotated[OSFilter, Query()]) -> OSParams:
     (
         variants_result,
         names_result,
@@ -45,63 +79,27 @@ def get_os_params(
         floppySizes_result,
         archs_result,
         tags_result,
-    ) = get_filtered_os_params(
-        variants, names, versions, disketteSizes, floppySizes, archs, tags
-    )
+    ) = await run_in_threadpool(get_filtered_os_params, **dict(filters))
 
     return OSParams(
-        variants=list(natsorted(variants_result)),
-        names=list(natsorted(names_result)),
-        versions=list(natsorted(versions_result)),
-        disketteSizes=list(natsorted(size for size in disketteSizes_result if size)),
-        floppySizes=list(natsorted(size for size in floppySizes_result if size)),
-        archs=list(natsorted(archs_result)),
-        tags=list(natsorted(tags_result)),
-    )
-
-
-@app.get("/os/count/")
-def get_os_count(
-    variants: Annotated[list[str] | None, Query()] = None,
-    names: Annotated[list[str] | None, Query()] = None,
-    versions: Annotated[list[str] | None, Query()] = None,
-    disketteSizes: Annotated[list[str] | None, Query()] = None,
-    floppySizes: Annotated[list[str] | None, Query()] = None,
-    archs: Annotated[list[str] | None, Query()] = None,
-    tags: Annotated[list[str] | None, Query()] = None,
-    search: Annotated[str | None, Query()] = None,
-) -> int:
-    filtered_manifests = get_filtered_os_manifests(
-        variants, names, versions, disketteSizes, floppySizes, archs, tags, search
+        variants=variants_result,
+        names=names_result,
+        versions=versions_result,
+        disketteSizes=disketteSizes_result,
+        floppySizes=floppySizes_result,
+        archs=archs_result,
+        tags=tags_result,
     )
 
-    return ilen(filtered_manifests)
 
+@app.get("/os/count/", response_model=int)
+@cache(expire=30)
+async def get_os_count(filters: Annotated[OSSearchFilter, Query()]) -> int:
+    mask = await run_in_threadpool(get_filtered_ids, **dict(filters))
+    return mask.bit_count()
 
-@app.get("/os/")
-def get_os(
-    variants: Annotated[list[str] | None, Query()] = None,
-    names: Annotated[list[str] | None, Query()] = None,
-    versions: Annotated[list[str] | None, Query()] = None,
-    disketteSizes: Annotated[list[str] | None, Query()] = None,
-    floppySizes: Annotated[list[str] | None, Query()] = None,
-    archs: Annotated[list[str] | None, Query()] = None,
-    tags: Annotated[list[str] | None, Query()] = None,
-    search: Annotated[str | None, Query()] = None,
-    ascBy: Annotated[str | None, Query()] = None,
-    descBy: Annotated[str | None, Query()] = None,
-    size: Annotated[int, Query(ge=1, le=100)] = 10,
-    page: Annotated[int, Query(ge=0)] = 0,
-) -> list[OS]:
-    filtered_manifests = get_filtered_os_manifests(
-        variants, names, versions, disketteSizes, floppySizes, archs, tags, search
-    )
 
-    sort_key = ascBy or descBy
-    if sort_key is not None:
-        filtered_manifests = natsorted(
-            filtered_manifests,
-            key=lambda os: os.get(sort_key, ""),
-            reverse=bool(descBy),
-        )
-    return list(islice(filtered_manifests, size * page, size * (page + 1)))
+@app.get("/os/", response_model=list[OS])
+@cache(expire=30)
+async def get_os(query: Annotated[OSPageQuery, Query()]) -> list[OS]:
+    return await run_in_threadpool(get_os_page, **dict(query))
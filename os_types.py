@@ -1,5 +1,7 @@
+from dataclasses import dataclass
 from typing_extensions import TypedDict
 from enum import Enum
+from pydantic import BaseModel, Field, field_validator
 
 
 class DisketteSize(str, Enum):
@@ -39,14 +41,15 @@ class Arch(str, Enum):
     LOONGARCH64 = "loongarch64"
 
 
-class OS(TypedDict):
+@dataclass(slots=True, frozen=True)
+class OS:
     variant: str
     name: str
     version: str
     disketteSize: DisketteSize | None
     floppySize: FloppySize | None
-    arch: list[Arch]
-    tags: list[str]
+    arch: tuple[Arch, ...]
+    tags: tuple[str, ...]
     extension: str
     size: int
     url: str
@@ -60,3 +63,40 @@ class OSParams(TypedDict):
     floppySizes: list[FloppySize]
     archs: list[Arch]
     tags: list[str]
+
+
+class OSFilter(BaseModel):
+    variants: list[str] | None = None
+    names: list[str] | None = None
+    versions: list[str] | None = None
+    disketteSizes: list[str] | None = None
+    floppySizes: list[str] | None = None
+    archs: list[str] | None = None
+    tags: list[str] | None = None
+
+    # declared as lists so that the query parameters keep their schema, frozen
+    # once here instead of in every lookup
+    @field_validator(
+        "variants",
+        "names",
+        "versions",
+        "disketteSizes",
+        "floppySizes",
+        "archs",
+        "tags",
+        mode="after",
+    )
+    @classmethod
+    def _freeze(cls, values: list[str] | None) -> frozenset[str] | None:
+        return frozenset(values) if values is not None else None
+
+
+class OSSearchFilter(OSFilter):
+    search: str | None = None
+
+
+class OSPageQuery(OSSearchFilter):
+    ascBy: str | None = None
+    descBy: str | None = None
+    size: int = Field(10, ge=1, le=100)
+    page: int = Field(0, ge=0)
@@ -12,12 +12,12 @@ by default, the logger is set to INFO level, you can change it to DEBUG to see m
 
 import asyncio
 import logging
+from collections import deque
 from pathlib import Path
 import aiohttp
-import aiofiles
 from urllib.parse import urlsplit, unquote, urljoin
 import re
-import bs4
+from selectolax.lexbor import LexborHTMLParser
 from typing import TypedDict
 from enum import Enum
 import os
@@ -100,7 +100,9 @@ ARCHS = {
 }
 
 
-async def download(url: str, dry: bool, chunk_size=1 << 15, tries=0):
+async def download(
+    session: aiohttp.ClientSession, url: str, dry: bool, chunk_size=1 << 20
+):
     async with semaphore:
         urlpath = urlsplit(url).path
         filename = Path(unquote(urlpath)).name
@@ -127,54 +129,57 @@ async def download(url: str, dry: bool, chunk_size=1 << 15, tries=0):
             logging.error(f"{filename} does not match pattern")
             return
         path = Path(filename)
-        if path.with_suffix(path.suffix + ".part").exists() or (
-            path.exists() and path.stat().st_size == 0
-        ):
+        part_path = path.with_suffix(path.suffix + ".part")
+        if part_path.exists() or (path.exists() and path.stat().st_size == 0):
             path.unlink(missing_ok=True)
         elif path.exists() and path.stat().st_size > 0:
             logging.warning(f"{filename} already exists")
             return
-        try:
-            logging.info("downloading %s", filename)
-            if not dry:
-                connector = aiohttp.TCPConnector(limit=5, force_close=True)
-                async with aiohttp.ClientSession(connector=connector) as session:
-                    async with session.get(url, timeout=None) as response:
-                        async with aiofiles.open(
-                            path.with_suffix(path.suffix + ".part"), "wb"
+        tries = 0
+        while True:
+            try:
+                logging.info("downloading %s", filename)
+                if not dry:
+                    async with session.get(
+                        url, timeout=None, read_bufsize=chunk_size
+                    ) as response:
+                        # plain buffered writes, the page cache absorbs them faster
+                        # than a thread hop per chunk through aiofiles
+                        with open(
+                            part_path,
+                            "wb",
+                            buffering=chunk_size,
                         ) as file:
-                            while True:
-                                chunk = await response.content.read(chunk_size)
-                                if not chunk:
-                                    break
-                                await file.write(chunk)
-                        path.with_suffix(path.suffix + ".part").rename(
-                            path.with_suffix(path.suffix)
-                        )
-            logging.info("done %s", filename)
-        except Exception as e:
-            path.unlink(missing_ok=True)
-            logging.exception(e)
-            logging.error("error while downloading %s", filename)
-            if tries < 5:
+                            async for chunk in response.content.iter_chunked(
+                                chunk_size
+                            ):
+                                file.write(chunk)
+                        part_path.rename(path)
+                logging.info("done %s", filename)
+                return
+            except Exception as e:
+                path.unlink(missing_ok=True)
+                logging.exception(e)
+                logging.error("error while downloading %s", filename)
+                if tries >= 5:
+                    logging.error("giving up downloading %s", filename)
+                    return
                 tries += 1
                 logging.info("trying again...")
-                asyncio.create_task(download(url, dry, chunk_size, tries))
-            else:
-                logging.error("giving up downloading %s", filename)
+                await asyncio.sleep(min(60, 2**tries))
 
 
 async def get_links(session: aiohttp.ClientSession, url: str) -> list[str]:
     logging.debug(f"Listing {url}")
     async with session.get(url) as resp:
         body = await resp.text()
-        body = bs4.BeautifulSoup(body, "lxml")
-        pre = body.find("pre")
-        if pre and isinstance(pre, bs4.element.Tag):
+        pre = LexborHTMLParser(body).css_first("pre")
+        if pre is not None:
+            hrefs = (a.attributes.get("href") for a in pre.css("a"))
             return [
-                urljoin(url, x.get("href"))
-                for x in pre.find_all("a")
-                if not (x.get("href").startswith("..") or x.get("href").startswith("?"))
+                urljoin(url, href)
+                for href in hrefs
+                if href and not href.startswith(("..", "?"))
             ]
         return []
 
@@ -182,20 +187,36 @@ async def get_links(session: aiohttp.ClientSession, url: str) -> list[str]:
 async def main():
     downloaders = []
 
-    connector = aiohttp.TCPConnector(limit=5, force_close=True)
+    # one pooled session for the listings and all downloads, so connections
+    # to the mirror are reused instead of negotiated again for every file; the
+    # pool is larger than the 5 downloads the semaphore lets through, so the
+    # listings still get connections while the downloads run
+    connector = aiohttp.TCPConnector(limit_per_host=8, keepalive_timeout=75)
     async with aiohttp.ClientSession(connector=connector) as session:
-        links = await get_links(
-            session,
-            "https://example.com",
+        # breadth first, listing up to 16 directories at a time and starting the
+        # downloads as soon as their links show up
+        queue = deque(
+            await get_links(
+                session,
+                "https://example.com",
+            )
         )
-        while links:
-            for link in links:
+        while queue:
+            batch = [queue.popleft() for _ in range(min(16, len(queue)))]
+            directories = []
+            for link in batch:
                 if link.endswith(".iso"):
-                    downloaders.append(download(link, DRY))
+                    downloaders.append(
+                        asyncio.create_task(download(session, link, DRY))
+                    )
                 else:
-                    links = await get_links(session, link)
+                    directories.append(link)
+            for links in await asyncio.gather(
+                *(get_links(session, directory) for directory in directories)
+            ):
+                queue.extend(links)
 
-    await asyncio.gather(*downloaders)
+        await asyncio.gather(*downloaders)
 
 
 if __name__ == "__main__":
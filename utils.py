@@ -1,10 +1,22 @@
-from typing import Generator
+from typing import Callable, Generator, Iterable
+from collections import defaultdict
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from bisect import bisect_right
+from itertools import accumulate, islice
+from operator import and_
+import heapq
 from pathlib import Path
 from os_types import OS, Arch, DisketteSize, FloppySize
 import re
 from dotenv import load_dotenv
-from os import getenv
+from os import DirEntry, getenv, scandir, sep, stat_result
+from os.path import join
+from sys import intern
 import watchfiles, threading
+import xxhash
+from natsort import natsort_keygen
 
 load_dotenv()
 
@@ -20,233 +32,700 @@ pattern = r"""
 
 filename_regex = re.compile(pattern, re.VERBOSE)
 
+NATKEY = natsort_keygen()
+
+# member of each value, looked up directly instead of through the enum call
+DISKETTE_SIZES = {size.value: size for size in DisketteSize}
+FLOPPY_SIZES = {size.value: size for size in FloppySize}
+ARCHS = {arch.value: arch for arch in Arch}
+
+# files kept next to the images that are never images themselves, rejected
+# before parsing; unfinished downloads are left out until they are renamed
+IGNORED_EXTENSIONS = frozenset(
+    "asc gpg htm html json log md md5 part sha1 sha256 sha512 sig txt".split()
+)
+
+ParsedFilename = tuple[str, str, str | None, str | None, str, str | None, str]
+
+
+def parse_filename(filename: str) -> ParsedFilename | None:
+    """
+    Groups of filename_regex for the filename, found by splitting on the
+    separators when the layout is unambiguous
+    """
+    parts = filename.split("_")
+    if len(parts) < 3:
+        return None
+    last = parts[-1]
+    if len(parts) <= 6 and all(parts[:-1]) and "\n" not in filename:
+        if len(parts) % 2:
+            # the arch is the last part, the extension starts at its last dot
+            arch, _, extension = last.rpartition(".")
+            tags = None
+        else:
+            # the tags are the last part, the extension starts at its first dot
+            tags, _, extension = last.partition(".")
+            arch = parts[-2]
+        if arch and tags != "" and extension:
+            if len(parts) >= 5:
+                return parts[0], parts[1], parts[2], parts[3], arch, tags, extension
+            return parts[0], parts[1], None, None, arch, tags, extension
+    # an extension holding underscores, or more parts than the layout has
+    match = filename_regex.match(filename)
+    if match is None:
+        return None
+    return match.groups()
+
+
+# both are fixed once the .env file is loaded, the archive path is resolved
+# so that it matches the absolute paths reported by watchfiles
+ARCHIVE_PATH = Path(getenv("ARCHIVE_PATH", "./")).resolve()
+DOWNLOAD_URL = getenv("DOWNLOAD_URL", "")
+ARCHIVE_PREFIX = join(ARCHIVE_PATH, "")
+
 
 def get_archive_path() -> Path:
-    return Path(getenv("ARCHIVE_PATH", "./"))
+    return ARCHIVE_PATH
+
+
+def get_redis_url() -> str | None:
+    return getenv("REDIS_URL")
+
+
+def is_behind_proxy() -> bool:
+    return getenv("BEHIND_PROXY", "False") == "True"
+
+
+def _list_directory(path: Path | str) -> list[DirEntry]:
+    # like rglob, a directory that can't be read is skipped rather than failing
+    # the whole walk
+    try:
+        with scandir(path) as it:
+            return list(it)
+    except PermissionError:
+        return []
+
+
+def _is_file(entry: DirEntry) -> bool:
+    # like Path.is_file, symlinks are followed and a broken or looping one is
+    # not a file
+    try:
+        return entry.is_file()
+    except OSError:
+        return False
+
+
+def scandir_recursive(
+    path: Path | str, skip_prefix: str | None = None
+) -> Generator[DirEntry, None, None]:
+    """
+    Files below the path, in the order of Path.rglob, leaving out the files and
+    directories whose name starts with skip_prefix
+    """
+    # the file type comes with the directory listing, so unlike rglob and
+    # is_file this costs no stat per entry
+    entries = [
+        entry
+        for entry in _list_directory(path)
+        if not (skip_prefix and entry.name.startswith(skip_prefix))
+    ]
+    for entry in entries:
+        if _is_file(entry):
+            yield entry
+    for entry in entries:
+        # symlinked directories are not descended into, as with rglob, which
+        # also keeps a symlink loop from recursing without end
+        if entry.is_dir(follow_symlinks=False):
+            yield from scandir_recursive(entry.path, skip_prefix)
+
+
+def scandir_variants() -> Generator[tuple[str, DirEntry], None, None]:
+    """
+    Files of the archive in the order of scandir_recursive, each with its
+    variant, the top level directory it was found under
+    """
+    entries = _list_directory(ARCHIVE_PATH)
+    for entry in entries:
+        if _is_file(entry):
+            yield entry.name, entry
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            for file in scandir_recursive(entry.path):
+                yield entry.name, file
 
 
 def get_os_file_list() -> Generator[str, None, None]:
-    return (
-        file.name
-        for file in get_archive_path().rglob("*")
-        if file.is_file() and not file.name.startswith("download")
-    )
+    return (entry.name for entry in scandir_recursive(ARCHIVE_PATH, "download"))
 
 
 def get_os_manifest_from_path(path: Path, without_size=False) -> OS | None:
     try:
-        varient = path.parts[3]
-        match = filename_regex.match(path.name)
-        if match is None:
+        relative_path = str(path.relative_to(ARCHIVE_PATH))
+    except ValueError as e:
+        print(f"Error parsing {path}: {e}")
+        return None
+    return _get_os_manifest(relative_path, None if without_size else path.stat)
+
+
+def get_os_manifest_from_entry(variant: str, entry: DirEntry) -> OS | None:
+    # entries of the walk all start with the archive path, so the relative path
+    # is a plain slice, and the entry keeps its stat result
+    return _get_os_manifest(
+        entry.path[len(ARCHIVE_PREFIX) :], entry.stat, variant=variant
+    )
+
+
+def _get_os_manifest(
+    relative_path: str,
+    stat: Callable[[], stat_result] | None,
+    variant: str | None = None,
+) -> OS | None:
+    try:
+        filename = relative_path.rpartition(sep)[2]
+        if filename.rpartition(".")[2].lower() in IGNORED_EXTENSIONS:
+            return None
+        varient = variant or relative_path.partition(sep)[0]
+        parsed = parse_filename(filename)
+        if parsed is None:
             return None
 
-        groups = match.groupdict()
+        os_name, version, disk_size, floppy_size, archs, tags, extension = parsed
         return OS(
-            variant=varient,
-            name=groups["os_name"],
-            version=groups["version"],
-            disketteSize=(
-                DisketteSize(groups.get("disk_size"))
-                if groups.get("disk_size")
-                else None
-            ),
-            floppySize=(
-                FloppySize(groups.get("floppy_size"))
-                if groups.get("floppy_size")
-                else None
-            ),
-            arch=[Arch(arch) for arch in groups["arch"].split(",")],
-            tags=groups.get("tags") and groups["tags"].split(",") or [],
-            extension=groups["extension"],
-            size=path.stat().st_size if not without_size else 0,
-            url=f"{getenv('DOWNLOAD_URL', '')}/{path.relative_to(get_archive_path())}",
+            variant=intern(varient),
+            name=intern(os_name),
+            version=intern(version),
+            disketteSize=DISKETTE_SIZES[disk_size] if disk_size else None,
+            floppySize=FLOPPY_SIZES[floppy_size] if floppy_size else None,
+            arch=tuple(ARCHS[arch] for arch in archs.split(",")),
+            tags=tuple(intern(tag) for tag in tags.split(",")) if tags else (),
+            extension=extension,
+            size=stat().st_size if stat else 0,
+            url=f"{DOWNLOAD_URL}/{relative_path}",
         )
     except ValueError as e:
-        print(f"Error parsing {path}: {e}")
+        print(f"Error parsing {ARCHIVE_PATH / relative_path}: {e}")
+        return None
+    except KeyError as e:
+        print(
+            f"Error parsing {ARCHIVE_PATH / relative_path}: "
+            f"{e} is not a known size or arch"
+        )
+        return None
+    except FileNotFoundError:
+        # deleted or renamed since it was listed, the watcher picks up the change
         return None
 
 
-CACHED_MANIFEST: list[OS] = []
+CACHED_MANIFEST: dict[str, OS] = {}
+MANIFEST_GENERATION = 0
 IS_INITIALIZED = False
+IS_WATCHING = False
+INIT_LOCK = threading.Lock()
+# held while CACHED_MANIFEST is updated by either the walk or the watcher
+MANIFEST_LOCK = threading.Lock()
+# urls the watcher updated while the walk runs, whose walk results are older
+WATCHED_URLS: set[str] = set()
 
 
 def watch_file_changes():
-    for changes in watchfiles.watch(get_archive_path()):
-        for change_type, path in changes:
-            if change_type == 1:
-                result = get_os_manifest_from_path(Path(path))
-                if result:
-                    CACHED_MANIFEST.append(result)
-            elif change_type == 3:
-                result = get_os_manifest_from_path(Path(path), without_size=True)
-                if result:
-                    for i, os in enumerate(CACHED_MANIFEST):
-                        if os["url"] == result["url"]:
-                            del CACHED_MANIFEST[i]
+    global MANIFEST_GENERATION
+    # watchfiles' defaults already batch a burst of events, yielding after 50ms
+    # of quiet or at most 1.6s
+    for changes in watchfiles.watch(ARCHIVE_PATH):
+        # a path added and deleted within the same batch is handled once, by
+        # whether the file is still there
+        paths = {path for change_type, path in changes if change_type in (1, 3)}
+        changed = False
+        for path in paths:
+            path = Path(path)
+            result = get_os_manifest_from_path(path, without_size=True)
+            if not result:
+                continue
+            try:
+                size = path.stat().st_size
+            except FileNotFoundError:
+                size = None
+            with MANIFEST_LOCK:
+                if not IS_INITIALIZED:
+                    WATCHED_URLS.add(result.url)
+                if size is None:
+                    changed |= CACHED_MANIFEST.pop(result.url, None) is not None
+                else:
+                    result = replace(result, size=size)
+                    changed |= CACHED_MANIFEST.get(result.url) != result
+                    CACHED_MANIFEST[result.url] = result
+        # files that are not manifests, such as .part or checksum files, leave
+        # the indexes and the cached responses alone
+        if changed:
+            MANIFEST_GENERATION += 1
 
 
 def generate_os_manifests():
     """
     Should be called once to generate all OS manifests
     """
-    global CACHED_MANIFEST, IS_INITIALIZED
-    if not IS_INITIALIZED:
-        IS_INITIALIZED = True
-        archive_path = get_archive_path()
-        for path in archive_path.rglob("*"):
-            if path.is_file():
-                result = get_os_manifest_from_path(path)
-                if result:
-                    CACHED_MANIFEST.append(result)
-        threading.Thread(target=watch_file_changes, daemon=True).start()
+    global CACHED_MANIFEST, IS_INITIALIZED, IS_WATCHING
+    if IS_INITIALIZED:
+        return
+    with INIT_LOCK:
+        # requests racing startup wait here for the walk instead of repeating it
+        if IS_INITIALIZED:
+            return
+        # watching first so that changes made during the walk are not missed;
+        # only once, as a failed walk is retried by the next call while the
+        # watcher keeps running
+        if not IS_WATCHING:
+            threading.Thread(target=watch_file_changes, daemon=True).start()
+            IS_WATCHING = True
+        files = list(scandir_variants())
+        # the stat calls release the gil, so they overlap on a cold disk cache
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            for result in executor.map(
+                lambda file: get_os_manifest_from_entry(*file), files
+            ):
+                if not result:
+                    continue
+                # the walk may have listed or stat'ed a file before the watcher
+                # saw it change, so the watcher's entry wins
+                with MANIFEST_LOCK:
+                    if result.url not in WATCHED_URLS:
+                        CACHED_MANIFEST[result.url] = result
+        with MANIFEST_LOCK:
+            WATCHED_URLS.clear()
+            IS_INITIALIZED = True
+
+
+FILTER_FIELDS = (
+    "variant",
+    "name",
+    "version",
+    "disketteSize",
+    "floppySize",
+    "arch",
+    "tags",
+)
+
+
+def mask_from_ids(ids: Iterable[int], size: int) -> int:
+    """
+    Bitmask with bit i set for every manifest id i
+    """
+    bits = bytearray((size + 7) // 8)
+    for i in ids:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, "little")
+
+
+def iter_ids(mask: int) -> Generator[int, None, None]:
+    """
+    Ids of the set bits of a mask, in ascending order
+    """
+    # scanning the binary string keeps the search for set bits in C, instead of
+    # isolating the lowest bit with a few bigint operations per id
+    bits = bin(mask)[:1:-1]
+    i = bits.find("1")
+    while i != -1:
+        yield i
+        i = bits.find("1", i + 1)
 
 
-def get_all_os_manifests() -> Generator[OS, None, None]:
+class Postings:
+    """
+    Manifests carrying each value, as a bitmask for the values carried by at
+    least 1/32 of the manifests and as an array of ids for the rest
+    """
+
+    def __init__(self, postings: dict[str, list[int]], size: int):
+        self.size = size
+        # a mask takes size bits however few ids it has, four bytes per id are
+        # less below 1/32, so a field with many distinct values such as the
+        # version costs memory in proportion to the manifests, not to both
+        self.masks = {
+            value: mask_from_ids(ids, size)
+            for value, ids in postings.items()
+            if len(ids) * 32 >= size
+        }
+        self.ids = {
+            value: array("I", ids)
+            for value, ids in postings.items()
+            if len(ids) * 32 < size
+        }
+
+    def mask(self, values: Iterable[str]) -> int:
+        """
+        Mask of the manifests carrying any of the values
+        """
+        mask = 0
+        ids = []
+        for value in values:
+            if value in self.masks:
+                mask |= self.masks[value]
+            else:
+                ids.extend(self.ids.get(value, ()))
+        if ids:
+            mask |= mask_from_ids(ids, self.size)
+        return mask
+
+
+class ManifestStore:
+    """
+    Snapshot of the cached manifests with an inverted index per filter field,
+    mapping each value to the manifests that carry it
+    """
+
+    def __init__(self, manifests: list[OS], generation: int = 0):
+        self.manifests = tuple(manifests)
+        self.generation = generation
+        self.all_mask = (1 << len(self.manifests)) - 1
+        self.columns: dict[str, list[tuple[str, ...]]] = {
+            "variant": [(os.variant,) for os in self.manifests],
+            "name": [(os.name,) for os in self.manifests],
+            "version": [(os.version,) for os in self.manifests],
+            "disketteSize": [
+                (os.disketteSize.value,) if os.disketteSize else ()
+                for os in self.manifests
+            ],
+            "floppySize": [
+                (os.floppySize.value,) if os.floppySize else () for os in self.manifests
+            ],
+            "arch": [tuple(arch.value for arch in os.arch) for os in self.manifests],
+            "tags": [os.tags for os in self.manifests],
+        }
+        self.index: dict[str, Postings] = {}
+        self.sorted_values: dict[str, list[str]] = {}
+        for field, column in self.columns.items():
+            postings = defaultdict(list)
+            for i, values in enumerate(column):
+                for value in values:
+                    postings[value].append(i)
+            self.index[field] = Postings(postings, len(self.manifests))
+            self.sorted_values[field] = sorted(postings, key=NATKEY)
+        lines = [
+            "\t".join(
+                value for column in self.columns.values() for value in column[i]
+            ).lower()
+            for i in range(len(self.manifests))
+        ]
+        self.haystack = "\n".join(lines)
+        self.line_starts = list(
+            accumulate((len(line) + 1 for line in lines), initial=0)
+        )
+        # answer of get_filtered_os_params without any filter, used to fill the
+        # initial dropdowns
+        self.unfiltered_params = tuple(
+            self.sorted_values[field] for field in FILTER_FIELDS
+        )
+        # content hash of the snapshot, computed with the store so that it is
+        # built off the event loop whenever the store is
+        self.digest = xxhash.xxh64(
+            "\n".join(sorted(f"{os.url}:{os.size}" for os in self.manifests)).encode()
+        ).hexdigest()
+        self._sort_keys: dict[str, list] = {}
+        self._trigrams: Postings | None = None
+
+    def sort_keys(self, field: str) -> list:
+        """
+        Natsort key of the field for every manifest, computed on first use
+        """
+        if field not in self._sort_keys:
+            self._sort_keys[field] = [
+                NATKEY(getattr(os, field)) for os in self.manifests
+            ]
+        return self._sort_keys[field]
+
+    def lookup(self, field: str, values: Iterable[str]) -> int:
+        """
+        Mask of the manifests whose field matches any of the values
+        """
+        return self.index[field].mask(frozenset(values))
+
+    def trigrams(self) -> Postings:
+        """
+        Manifests containing each three character substring of a lowercased
+        field, computed on first use
+        """
+        if self._trigrams is None:
+            postings = defaultdict(list)
+            if self.manifests:
+                for i, line in enumerate(self.haystack.split("\n")):
+                    for trigram in {line[j : j + 3] for j in range(len(line) - 2)}:
+                        if "\t" not in trigram:
+                            postings[trigram].append(i)
+            self._trigrams = Postings(postings, len(self.manifests))
+        return self._trigrams
+
+    def search(self, search: str, candidates: int | None = None) -> int:
+        """
+        Mask of the candidates, all manifests by default, with a field containing
+        the search, case-insensitive
+        """
+        search = search.lower()
+        if "\t" in search or "\n" in search:
+            return 0
+        if candidates is None:
+            candidates = self.all_mask
+        if not search:
+            # every field contains the empty string
+            return candidates
+        if len(search) >= 3:
+            # a match contains every trigram of the search, which narrows the
+            # lines to check down to those holding all of them
+            trigrams = self.trigrams()
+            for trigram in {search[j : j + 3] for j in range(len(search) - 2)}:
+                candidates &= trigrams.mask((trigram,))
+                if not candidates:
+                    return 0
+        if candidates.bit_count() * 8 < len(self.manifests):
+            # with few candidates left, their lines are cheaper to test one by
+            # one than scanning the whole haystack
+            starts = self.line_starts
+            return mask_from_ids(
+                (
+                    i
+                    for i in iter_ids(candidates)
+                    if self.haystack.find(search, starts[i], starts[i + 1] - 1) != -1
+                ),
+                len(self.manifests),
+            )
+        ids = []
+        pos = self.haystack.find(search)
+        while pos != -1:
+            i = bisect_right(self.line_starts, pos) - 1
+            ids.append(i)
+            pos = self.haystack.find(search, self.line_starts[i + 1])
+        return mask_from_ids(ids, len(self.manifests)) & candidates
+
+
+STORE: ManifestStore | None = None
+STORE_LOCK = threading.Lock()
+
+
+def get_manifest_fingerprint() -> int:
     if not IS_INITIALIZED:
         generate_os_manifests()
-    for m in CACHED_MANIFEST:
-        yield m
+    return MANIFEST_GENERATION
+
+
+def get_manifest_store() -> ManifestStore:
+    """
+    Snapshot of the current generation, rebuilt only when the generation changes
+    """
+    global STORE
+    store = STORE
+    if store is not None and store.generation == get_manifest_fingerprint():
+        return store
+    # requests arriving after a change wait here for a single rebuild instead
+    # of each building their own
+    with STORE_LOCK:
+        generation = get_manifest_fingerprint()
+        if STORE is None or STORE.generation != generation:
+            STORE = ManifestStore(list(CACHED_MANIFEST.values()), generation)
+        return STORE
+
+
+def get_current_manifest_store() -> ManifestStore | None:
+    """
+    The store if it is already built for the current generation, None when
+    getting it would walk the archive or rebuild the store
+    """
+    store = STORE
+    if IS_INITIALIZED and store is not None and store.generation == MANIFEST_GENERATION:
+        return store
+    return None
+
+
+def get_manifest_digest() -> str:
+    """
+    Content hash of the manifests, identical across workers serving the same archive
+    """
+    return get_manifest_store().digest
+
+
+def get_all_os_manifests() -> tuple[OS, ...]:
+    """
+    The manifests of the current snapshot, which is never mutated
+    """
+    return get_manifest_store().manifests
+
+
+def _filter_mask(
+    store: ManifestStore,
+    variants: Iterable[str] | None,
+    names: Iterable[str] | None,
+    versions: Iterable[str] | None,
+    disketteSizes: Iterable[str] | None,
+    floppySizes: Iterable[str] | None,
+    archs: Iterable[str] | None,
+    tags: Iterable[str] | None,
+    search: str | None,
+) -> int:
+    active = [
+        (field, frozenset(values))
+        for field, values in zip(
+            FILTER_FIELDS,
+            (variants, names, versions, disketteSizes, floppySizes, archs, tags),
+        )
+        if values
+    ]
+    # filters with fewer values tend to match fewer manifests, so they go first
+    # and the rest is skipped once nothing is left
+    active.sort(key=lambda filter: len(filter[1]))
+    mask = store.all_mask
+    for field, values in active:
+        mask &= store.lookup(field, values)
+        if not mask:
+            return 0
+    if search:
+        mask &= store.search(search, candidates=mask)
+    return mask
+
+
+def get_filtered_ids(
+    variants: Iterable[str] | None = None,
+    names: Iterable[str] | None = None,
+    versions: Iterable[str] | None = None,
+    disketteSizes: Iterable[str] | None = None,
+    floppySizes: Iterable[str] | None = None,
+    archs: Iterable[str] | None = None,
+    tags: Iterable[str] | None = None,
+    search: str | None = None,
+) -> int:
+    """
+    Mask of the ids of the manifests matching every filter
+    """
+    return _filter_mask(
+        get_manifest_store(),
+        variants,
+        names,
+        versions,
+        disketteSizes,
+        floppySizes,
+        archs,
+        tags,
+        search,
+    )
 
 
 def get_filtered_os_manifests(
-    variants: list[str] | None = None,
-    names: list[str] | None = None,
-    versions: list[str] | None = None,
-    disketteSizes: list[str] | None = None,
-    floppySizes: list[str] | None = None,
-    archs: list[str] | None = None,
-    tags: list[str] | None = None,
+    variants: Iterable[str] | None = None,
+    names: Iterable[str] | None = None,
+    versions: Iterable[str] | None = None,
+    disketteSizes: Iterable[str] | None = None,
+    floppySizes: Iterable[str] | None = None,
+    archs: Iterable[str] | None = None,
+    tags: Iterable[str] | None = None,
     search: str | None = None,
-) -> Generator[OS, None, None]:
-    for os in get_all_os_manifests():
-        if (
-            (not variants or os["variant"] in variants)
-            and (not names or os["name"] in names)
-            and (not versions or os["version"] in versions)
-            and (
-                not disketteSizes
-                or (os["disketteSize"] and os["disketteSize"].value in disketteSizes)
-            )
-            and (
-                not floppySizes
-                or (os["floppySize"] and os["floppySize"].value in floppySizes)
-            )
-            and (not archs or any(arch.value in archs for arch in os["arch"]))
-            and (not tags or any(tag in os["tags"] for tag in tags))
-            and (
-                not search
-                or search.lower() in os["variant"].lower()
-                or search.lower() in os["name"].lower()
-                or search.lower() in os["version"].lower()
-                or (
-                    os["disketteSize"]
-                    and search.lower() in os["disketteSize"].value.lower()
-                )
-                or (
-                    os["floppySize"]
-                    and search.lower() in os["floppySize"].value.lower()
-                )
-                or any(search.lower() in arch.value.lower() for arch in os["arch"])
-                or any(search.lower() in tag.lower() for tag in os["tags"])
-            )
-        ):
-            yield os
+) -> list[OS]:
+    store = get_manifest_store()
+    mask = _filter_mask(
+        store,
+        variants,
+        names,
+        versions,
+        disketteSizes,
+        floppySizes,
+        archs,
+        tags,
+        search,
+    )
+    return [store.manifests[i] for i in iter_ids(mask)]
 
 
-def get_filtered_os_params(
-    variants: list[str] | None = None,
-    names: list[str] | None = None,
-    versions: list[str] | None = None,
-    disketteSizes: list[str] | None = None,
-    floppySizes: list[str] | None = None,
-    archs: list[str] | None = None,
-    tags: list[str] | None = None,
+def get_os_page(
+    variants: Iterable[str] | None = None,
+    names: Iterable[str] | None = None,
+    versions: Iterable[str] | None = None,
+    disketteSizes: Iterable[str] | None = None,
+    floppySizes: Iterable[str] | None = None,
+    archs: Iterable[str] | None = None,
+    tags: Iterable[str] | None = None,
     search: str | None = None,
-) -> tuple[set, set, set, set, set, set, set]:
-    variants_result = set()
-    names_result = set()
-    versions_result = set()
-    disketteSizes_result = set()
-    floppySizes_result = set()
-    archs_result = set()
-    tags_result = set()
-
-    option_list = {
-        "variant",
-        "name",
-        "version",
-        "disketteSize",
-        "floppySize",
-        "arch",
-        "tags",
-    }
-
-    for os in get_all_os_manifests():
-        unused_options = set()
-
-        if variants is not None and os["variant"] not in variants:
-            unused_options.update(option_list.difference(("variant",)))
-
-        if names is not None and os["name"] not in names:
-            unused_options.update(option_list.difference(("name",)))
-
-        if versions is not None and os["version"] not in versions:
-            unused_options.update(option_list.difference(("version",)))
-
-        if disketteSizes is not None and (
-            os["disketteSize"] is None or os["disketteSize"].value not in disketteSizes
-        ):
-            unused_options.update(option_list.difference(("disketteSize",)))
+    ascBy: str | None = None,
+    descBy: str | None = None,
+    size: int = 10,
+    page: int = 0,
+) -> list[OS]:
+    store = get_manifest_store()
+    ids = iter_ids(
+        _filter_mask(
+            store,
+            variants,
+            names,
+            versions,
+            disketteSizes,
+            floppySizes,
+            archs,
+            tags,
+            search,
+        )
+    )
 
-        if floppySizes is not None and (
-            os["floppySize"] is None or os["floppySize"].value not in floppySizes
-        ):
-            unused_options.update(option_list.difference(("floppySize",)))
-
-        if archs is not None and not any(arch.value in archs for arch in os["arch"]):
-            unused_options.update(option_list.difference(("arch",)))
-
-        if tags is not None and not any(tag in os["tags"] for tag in tags):
-            unused_options.update(option_list.difference(("tags",)))
-
-        if search is not None and (
-            True
-            and search.lower() not in os["variant"].lower()
-            and search.lower() not in os["name"].lower()
-            and search.lower() not in os["version"].lower()
-            and not any(search.lower() in arch.value.lower() for arch in os["arch"])
-            and not any(search.lower() in tag.lower() for tag in os["tags"])
-            and not (
-                os["disketteSize"]
-                and search.lower() in os["disketteSize"].value.lower()
-            )
-            and not (
-                os["floppySize"] and search.lower() in os["floppySize"].value.lower()
-            )
+    # unknown keys compare equal for every manifest, which leaves the order as is
+    sort_key = ascBy or descBy
+    if sort_key in OS.__annotations__:
+        # only the manifests up to the end of the requested page need ordering
+        select = heapq.nlargest if descBy else heapq.nsmallest
+        ids = select(size * (page + 1), ids, key=store.sort_keys(sort_key).__getitem__)
+    return [store.manifests[i] for i in islice(ids, size * page, size * (page + 1))]
+
+
+def get_filtered_os_params(
+    variants: Iterable[str] | None = None,
+    names: Iterable[str] | None = None,
+    versions: Iterable[str] | None = None,
+    disketteSizes: Iterable[str] | None = None,
+    floppySizes: Iterable[str] | None = None,
+    archs: Iterable[str] | None = None,
+    tags: Iterable[str] | None = None,
+    search: str | None = None,
+) -> tuple[list[str], ...]:
+    """
+    Natsorted values of each field among the manifests matching every filter
+    but the field's own, so that selecting one value keeps its alternatives listed
+    """
+    store = get_manifest_store()
+    filters = (variants, names, versions, disketteSizes, floppySizes, archs, tags)
+    if search is None and all(values is None for values in filters):
+        return store.unfiltered_params
+
+    search_mask = store.search(search) if search is not None else store.all_mask
+    matched_masks = [
+        store.lookup(field, values) if values is not None else store.all_mask
+        for field, values in zip(FILTER_FIELDS, filters)
+    ]
+    # the mask of every filter but one field's is the AND of the filters before
+    # and after it, so the filtering is done once instead of once per field
+    before = list(accumulate(matched_masks, and_, initial=search_mask))
+    after = list(accumulate(reversed(matched_masks), and_, initial=store.all_mask))
+
+    results = {}
+    # fields cheaper to project by walking their matching rows, grouped by mask
+    # so that every field sharing a mask is filled in the same pass
+    row_projections = defaultdict(list)
+    for i, field in enumerate(FILTER_FIELDS):
+        mask = before[i] & after[len(FILTER_FIELDS) - 1 - i]
+        if mask == store.all_mask:
+            results[field] = store.sorted_values[field]
+        elif (
+            mask.bit_count() < len(store.sorted_values[field]) or store.index[field].ids
         ):
-            unused_options.update(option_list)
-
-        if "variant" not in unused_options:
-            variants_result.add(os["variant"])
-        if "name" not in unused_options:
-            names_result.add(os["name"])
-        if "version" not in unused_options:
-            versions_result.add(os["version"])
-        if "disketteSize" not in unused_options:
-            disketteSizes_result.add(os["disketteSize"])
-        if "floppySize" not in unused_options:
-            floppySizes_result.add(os["floppySize"])
-        if "arch" not in unused_options:
-            archs_result.update(os["arch"])
-        if "tags" not in unused_options:
-            tags_result.update(os["tags"])
-
-    return (
-        variants_result,
-        names_result,
-        versions_result,
-        disketteSizes_result,
-        floppySizes_result,
-        archs_result,
-        tags_result,
-    )
+            # testing a bit of a mask costs as much as the whole mask, so values
+            # kept as ids are found by walking the rows
+            row_projections[mask].append(field)
+        else:
+            masks = store.index[field].masks
+            results[field] = [
+                value for value in store.sorted_values[field] if masks[value] & mask
+            ]
+
+    for mask, fields in row_projections.items():
+        found = {field: set() for field in fields}
+        for i in iter_ids(mask):
+            for field in fields:
+                found[field].update(store.columns[field][i])
+        for field in fields:
+            results[field] = [
+                value for value in store.sorted_values[field] if value in found[field]
+            ]
+
+    return tuple(results[field] for field in FILTER_FIELDS)